@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 
 import json
+import os
 import webbrowser
 from functools import partial
 from pathlib import Path
@@ -66,6 +67,7 @@ prefs.defaults["cuda"] = "cu118"
 prefs.defaults["last_opened_kindle_lemmas_language"] = "ca"
 prefs.defaults["last_opened_wiktionary_lemmas_language"] = "ca"
 prefs.defaults["use_wiktionary_for_kindle"] = False
+prefs.defaults["spacy_processes"] = 1
 for code in load_plugin_json(get_plugin_path(), "data/languages.json").keys():
     prefs.defaults[f"{code}_wiktionary_difficulty_limit"] = 5
 
@@ -153,6 +155,18 @@ class ConfigWidget(QWidget):
         self.model_size_box.setCurrentText(spacy_model_sizes[prefs["model_size"]])
         form_layout.addRow(model_size_label, self.model_size_box)
 
+        self.spacy_processes = QSpinBox()
+        self.spacy_processes.setRange(1, os.cpu_count() or 1)
+        self.spacy_processes.setValue(prefs["spacy_processes"])
+        spacy_processes_label = QLabel(_("spaCy processes"))
+        spacy_processes_label.setToolTip(
+            _(
+                "Number of processes used to find named entities and Word Wise words, "
+                "GPU and calibre installed from source only use one process"
+            )
+        )
+        form_layout.addRow(spacy_processes_label, self.spacy_processes)
+
         self.minimal_x_ray_count = QSpinBox()
         self.minimal_x_ray_count.setMinimum(1)
         self.minimal_x_ray_count.setValue(prefs["minimal_x_ray_count"])
@@ -222,6 +236,7 @@ class ConfigWidget(QWidget):
         prefs["fandom"] = self.fandom_url.text().removesuffix("/")
         prefs["add_locator_map"] = self.locator_map_box.isChecked()
         prefs["minimal_x_ray_count"] = self.minimal_x_ray_count.value()
+        prefs["spacy_processes"] = self.spacy_processes.value()
         if not ismacos:
             prefs["use_gpu"] = self.use_gpu_box.isChecked()
             prefs["cuda"] = self.cuda_version_box.currentData()
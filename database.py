@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 import sqlite3
 from pathlib import Path
-from typing import Iterator
+from typing import Iterable, Iterator
 
 try:
     from .utils import load_plugin_json
@@ -50,8 +50,10 @@ def create_lang_layer(
     return ll_conn, db_path
 
 
-def insert_lemma(ll_conn: sqlite3.Connection, data: tuple[int, int, int, int]) -> None:
-    ll_conn.execute(
+def insert_lemmas(
+    ll_conn: sqlite3.Connection, data: Iterable[tuple[int, int | None, int, int]]
+) -> None:
+    ll_conn.executemany(
         """
         INSERT INTO glosses (start, end, difficulty, sense_id, low_confidence)
         VALUES (?, ?, ?, ?, 0)
@@ -190,10 +192,10 @@ def insert_x_entities(
     )
 
 
-def insert_x_entity_description(
-    conn: sqlite3.Connection, data: tuple[str, str, int | None, int]
+def insert_x_entity_descriptions(
+    conn: sqlite3.Connection, data: Iterable[tuple[str, str, int | None, int]]
 ) -> None:
-    conn.execute("INSERT INTO entity_description VALUES(?, ?, ?, ?)", data)
+    conn.executemany("INSERT INTO entity_description VALUES(?, ?, ?, ?)", data)
 
 
 def insert_x_occurrences(
@@ -6,7 +6,6 @@ import shutil
 import sqlite3
 import zipfile
 from collections import defaultdict
-from functools import partial
 from html import escape, unescape
 from pathlib import Path
 from typing import Iterator
@@ -59,6 +58,14 @@ NAMESPACES = {
     "xml": "http://www.w3.org/1999/xhtml",
 }
 
+# soft hyphen, byte order mark, word joiner
+REMOVED_CHARS_TABLE = str.maketrans(dict.fromkeys("\xad\ufeff\u2060"))
+REMOVED_ENTITIES_RE = re.compile(r"&(?:shy|#xad|#173|NoBreak);", re.I)
+COMPRESSED_IMAGE_SUFFIXES = frozenset([".gif", ".jpeg", ".jpg", ".png", ".webp"])
+BODY_RE = re.compile(r"<body.{3,}?</body>", re.DOTALL)
+# text between HTML tags
+TEXT_RE = re.compile(r">([^<]{2,})<")
+
 
 class EPUB:
     def __init__(
@@ -75,11 +82,17 @@ class EPUB:
         self.wikidata = wikidata
         self.entity_id = 0
         self.entities: dict[str, XRayEntity] = {}
+        # entity name -> `default_process` result, in the order of `entities`
+        self.processed_entities: dict[str, str] = {}
+        # normalized name -> entity name, catch near-exact names before fuzzy match
+        self.normalized_entities: dict[str, str] = {}
         self.entity_occurrences: dict[
             Path, list[tuple[int, int, str, int | str]]
         ] = defaultdict(list)
         self.removed_entity_ids: set[int] = set()
         self.extract_folder = self.book_path.with_name("extract")
+        # file name -> paths, for manifest paths that are not relative to root
+        self.extracted_files: defaultdict[str, list[Path]] | None = None
         if self.extract_folder.exists():
             shutil.rmtree(self.extract_folder)
         self.xhtml_folder = self.extract_folder
@@ -91,6 +104,8 @@ class EPUB:
         self.lemmas: dict[str, int] = {}
         self.lemma_id = 0
         self.lemmas_conn: sqlite3.Connection | None = None
+        self.lemma_glosses: dict[tuple[str, str], list[tuple[str, str, str, str]]] = {}
+        self.word_wise_tags: dict[tuple[str, str], str] = {}
         self.prefs: Prefs = {}
 
     def extract_epub(self) -> Iterator[tuple[str, tuple[int, str, Path]]]:
@@ -99,22 +114,23 @@ class EPUB:
         with zipfile.ZipFile(self.book_path) as zf:
             zf.extractall(self.extract_folder)
 
+        # don't build ID table or expand entities for container and OPF files
+        self.xml_parser = etree.XMLParser(
+            resolve_entities=False, no_network=True, collect_ids=False, huge_tree=False
+        )
+
         with self.extract_folder.joinpath("META-INF/container.xml").open("rb") as f:
-            root = etree.fromstring(f.read())
+            root = etree.fromstring(f.read(), self.xml_parser)
             opf_path = unquote(root.find(".//n:rootfile", NAMESPACES).get("full-path"))
-            self.opf_path = self.extract_folder.joinpath(opf_path)
-            if not self.opf_path.exists():
-                self.opf_path = next(self.extract_folder.rglob(opf_path))
+            self.opf_path = self.find_extracted_path(opf_path)
         with self.opf_path.open("rb") as opf:
-            self.opf_root = etree.fromstring(opf.read())
+            self.opf_root = etree.fromstring(opf.read(), self.xml_parser)
             for item in self.opf_root.xpath(
                 'opf:manifest/opf:item[starts-with(@media-type, "image/")]',
                 namespaces=NAMESPACES,
             ):
                 image_href = unquote(item.get("href"))
-                image_path = self.extract_folder.joinpath(image_href)
-                if not image_path.exists():
-                    image_path = next(self.extract_folder.rglob(image_href))
+                image_path = self.find_extracted_path(image_href)
                 if not image_path.parent.samefile(self.extract_folder):
                     self.image_folder = image_path.parent
                 if "/" in image_href:
@@ -127,33 +143,53 @@ class EPUB:
                 if item.get("properties") == "nav":
                     continue
                 xhtml_href = unquote(item.get("href"))
-                xhtml_path = self.extract_folder.joinpath(xhtml_href)
-                if not xhtml_path.exists():
-                    xhtml_path = next(self.extract_folder.rglob(xhtml_href))
+                xhtml_path = self.find_extracted_path(xhtml_href)
                 if not xhtml_path.parent.samefile(self.extract_folder):
                     self.xhtml_folder = xhtml_path.parent
                 if "/" in xhtml_href:
                     self.xhtml_href_has_folder = True
-                with xhtml_path.open("r", encoding="utf-8") as f:
-                    # remove soft hyphen, byte order mark, word joiner
-                    xhtml_text = re.sub(
-                        r"\xad|&shy;|&#xad;|&#173;|\ufeff|\u2060|&NoBreak;",
-                        "",
-                        f.read(),
-                        flags=re.I,
-                    )
-                with xhtml_path.open("w", encoding="utf-8") as f:
-                    f.write(xhtml_text)
-                for match_body in re.finditer(
-                    r"<body.{3,}?</body>", xhtml_text, re.DOTALL
-                ):
-                    for m in re.finditer(r">[^<]{2,}<", match_body.group(0)):
-                        text = m.group(0)[1:-1]
-                        yield unescape(text), (
-                            match_body.start() + m.start() + 1,
-                            text,
-                            xhtml_path,
-                        )
+                with xhtml_path.open("r+", encoding="utf-8") as f:
+                    original_text = f.read()
+                    xhtml_text = original_text.translate(REMOVED_CHARS_TABLE)
+                    if "&" in xhtml_text:
+                        xhtml_text = REMOVED_ENTITIES_RE.sub("", xhtml_text)
+                    # most files have nothing to remove, don't rewrite them
+                    if xhtml_text != original_text:
+                        f.seek(0)
+                        f.write(xhtml_text)
+                        f.truncate()
+                # scan body in place, offsets are used to insert anchor elements
+                for match_body in BODY_RE.finditer(xhtml_text):
+                    for m in TEXT_RE.finditer(
+                        xhtml_text, match_body.start(), match_body.end()
+                    ):
+                        text = m.group(1)
+                        yield unescape(text), (m.start(1), text, xhtml_path)
+
+    def find_extracted_path(self, href: str) -> Path:
+        path = self.extract_folder.joinpath(href)
+        if path.exists():
+            return path
+        if self.extracted_files is None:
+            self.extracted_files = defaultdict(list)
+            for extracted_path in self.extract_folder.rglob("*"):
+                if extracted_path.is_file():
+                    self.extracted_files[extracted_path.name].append(extracted_path)
+        href_parts = tuple(part for part in Path(href).parts if part not in (".", ".."))
+        indexed_path = next(
+            (
+                extracted_path
+                for extracted_path in self.extracted_files.get(Path(href).name, [])
+                if extracted_path.parts[-len(href_parts) :] == href_parts
+            ),
+            None,
+        )
+        # case-insensitive file systems could match a name in different case
+        return (
+            indexed_path
+            if indexed_path is not None
+            else next(self.extract_folder.rglob(href))
+        )
 
     def add_entity(
         self,
@@ -169,24 +205,38 @@ class EPUB:
         from rapidfuzz.process import extractOne
         from rapidfuzz.utils import default_process
 
+        normalized_entity = normalize_entity(entity)
         if entity_data := self.entities.get(entity):
             entity_id = entity_data["id"]
             entity_data["count"] += 1
         elif entity not in self.custom_x_ray and (
+            normalized_name := self.normalized_entities.get(normalized_entity)
+        ):
+            entity_data = self.entities[normalized_name]
+            entity_id = entity_data["id"]
+            entity_data["count"] += 1
+        elif entity not in self.custom_x_ray and (
+            # choices are already processed, only process the query once
             r := extractOne(
-                entity,
-                self.entities.keys(),
+                default_process(entity),
+                self.processed_entities,
                 score_cutoff=FUZZ_THRESHOLD,
-                scorer=partial(token_set_ratio, processor=default_process),
+                scorer=token_set_ratio,
             )
         ):
-            matched_name = r[0]
+            matched_name = r[2]
             matched_entity = self.entities[matched_name]
             matched_entity["count"] += 1
             entity_id = matched_entity["id"]
             if is_full_name(matched_name, matched_entity["label"], entity, ner_label):
                 self.entities[entity] = matched_entity
                 del self.entities[matched_name]
+                self.processed_entities[entity] = default_process(entity)
+                del self.processed_entities[matched_name]
+                normalized_name = normalize_entity(matched_name)
+                if self.normalized_entities.get(normalized_name) == matched_name:
+                    del self.normalized_entities[normalized_name]
+                self.normalized_entities.setdefault(normalized_entity, entity)
         else:
             entity_id = self.entity_id
             self.entities[entity] = {
@@ -195,6 +245,8 @@ class EPUB:
                 "quote": book_quote,
                 "count": 1,
             }
+            self.processed_entities[entity] = default_process(entity)
+            self.normalized_entities.setdefault(normalized_entity, entity)
             self.entity_id += 1
 
         self.entity_occurrences[xhtml_path].append(
@@ -254,46 +306,51 @@ class EPUB:
     def insert_anchor_elements(self, lang: str) -> None:
         for xhtml_path, entity_list in self.entity_occurrences.items():
             if self.entities and self.lemmas:
-                entity_list = sorted(entity_list, key=operator.itemgetter(0))
+                # X-Ray and Word Wise occurrences are only interleaved per text,
+                # the list is almost sorted
+                entity_list.sort(key=operator.itemgetter(0))
 
             with xhtml_path.open(encoding="utf-8") as f:
                 xhtml_str = f.read()
-            new_xhtml_str = ""
-            last_end = 0
-            for start, end, entity, entity_id in entity_list:
-                if entity_id in self.removed_entity_ids:
-                    continue
-                new_xhtml_str += xhtml_str[last_end:start]
-                if isinstance(entity_id, int):
-                    new_xhtml_str += (
-                        f'<a epub:type="noteref" href="x_ray.xhtml#'
-                        f'{entity_id}">{entity}</a>'
-                    )
-                else:
-                    new_xhtml_str += self.build_word_wise_tag(entity_id, entity, lang)
-                last_end = end
-            new_xhtml_str += xhtml_str[last_end:]
-
-            # add epub namespace and Word Wise CSS
+            # all anchors are inside the body found by `extract_epub`
+            last_end = xhtml_str.index("<body")
             with xhtml_path.open("w", encoding="utf-8") as f:
-                if NAMESPACES["ops"] not in new_xhtml_str:
-                    new_xhtml_str = new_xhtml_str.replace(
-                        f'xmlns="{NAMESPACES["xml"]}"',
-                        f'xmlns="{NAMESPACES["xml"]}" '
-                        f'xmlns:epub="{NAMESPACES["ops"]}"',
-                    )
-                if self.lemmas:
-                    new_xhtml_str = new_xhtml_str.replace(
-                        "</head>",
-                        "<style>body {line-height: 2.5;} ruby "
-                        "{text-decoration:overline;} ruby a {text-decoration:none;}"
-                        "</style></head>",
-                    )
-                f.write(new_xhtml_str)
+                f.write(self.modify_xhtml_head(xhtml_str[:last_end]))
+                for start, end, entity, entity_id in entity_list:
+                    if entity_id in self.removed_entity_ids:
+                        continue
+                    f.write(xhtml_str[last_end:start])
+                    if isinstance(entity_id, int):
+                        f.write(
+                            f'<a epub:type="noteref" href="x_ray.xhtml#'
+                            f'{entity_id}">{entity}</a>'
+                        )
+                    else:
+                        f.write(self.build_word_wise_tag(entity_id, entity, lang))
+                    last_end = end
+                f.write(xhtml_str[last_end:])
+
+    def modify_xhtml_head(self, xhtml_head: str) -> str:
+        # add epub namespace and Word Wise CSS
+        if NAMESPACES["ops"] not in xhtml_head:
+            xhtml_head = xhtml_head.replace(
+                f'xmlns="{NAMESPACES["xml"]}"',
+                f'xmlns="{NAMESPACES["xml"]}" xmlns:epub="{NAMESPACES["ops"]}"',
+            )
+        if self.lemmas:
+            xhtml_head = xhtml_head.replace(
+                "</head>",
+                "<style>body {line-height: 2.5;} ruby "
+                "{text-decoration:overline;} ruby a {text-decoration:none;}"
+                "</style></head>",
+            )
+        return xhtml_head
 
     def build_word_wise_tag(self, word: str, origin_word: str, lang: str) -> str:
         if word not in self.lemmas:
             return origin_word
+        if tag := self.word_wise_tags.get((word, origin_word)):
+            return tag
         data = self.get_lemma_gloss(word, lang)
         if not data:
             del self.lemmas[word]
@@ -302,16 +359,18 @@ class EPUB:
         len_ratio = 3 if lang in CJK_LANGS else 2.5
         word_id = self.lemmas[word]
         if len(short_def) / len(origin_word) > len_ratio:
-            return (
+            tag = (
                 '<a epub:type="noteref" href="word_wise.xhtml#'
                 f'{word_id}">{origin_word}</a>'
             )
         else:
-            return (
+            tag = (
                 '<ruby><a epub:type="noteref" href="word_wise.xhtml#'
                 f'{word_id}">{origin_word}</a><rp>(</rp><rt>{short_def}'
                 "</rt><rp>)</rp></ruby>"
             )
+        self.word_wise_tags[(word, origin_word)] = tag
+        return tag
 
     def split_p_tags(self, intro: str) -> str:
         intro = escape(intro)
@@ -329,95 +388,114 @@ class EPUB:
             image_prefix += "../"
         if self.image_href_has_folder:
             image_prefix += f"{self.image_folder.name}/"
-        s = f"""
+        # load all descriptions at once instead of querying each entity
+        intro_caches = self.mediawiki.get_caches(list(self.entities))
+        wikidata_caches = (
+            self.wikidata.get_caches(
+                [
+                    intro_cache["item_id"]
+                    for intro_cache in intro_caches.values()
+                    if not isinstance(intro_cache, str) and intro_cache["item_id"]
+                ]
+            )
+            if self.wikidata
+            else {}
+        )
+        with self.xhtml_folder.joinpath("x_ray.xhtml").open("w", encoding="utf-8") as f:
+            f.write(
+                f"""
         <html xmlns="http://www.w3.org/1999/xhtml"
         xmlns:epub="http://www.idpf.org/2007/ops"
         lang="{lang}" xml:lang="{lang}">
         <head><title>X-Ray</title><meta charset="utf-8"/></head>
         <body>
         """
-        for entity, data in self.entities.items():
-            if custom_data := self.custom_x_ray.get(entity):
-                custom_desc, custom_source_id, _ = custom_data
-                s += (
-                    f'<aside id="{data["id"]}" epub:type="footnote">'
-                    f"{self.split_p_tags(custom_desc)}"
-                )
-                if custom_source_id:
-                    custom_source_name, custom_source_link = x_ray_source(
-                        custom_source_id, prefs, lang
+            )
+            for entity, data in self.entities.items():
+                if custom_data := self.custom_x_ray.get(entity):
+                    custom_desc, custom_source_id, _ = custom_data
+                    f.write(
+                        f'<aside id="{data["id"]}" epub:type="footnote">'
+                        f"{self.split_p_tags(custom_desc)}"
                     )
-                    if custom_source_link:
-                        s += (
-                            f'<p>Source: <a href="{custom_source_link}{quote(entity)}'
-                            f'">{custom_source_name}</a></p>'
+                    if custom_source_id:
+                        custom_source_name, custom_source_link = x_ray_source(
+                            custom_source_id, prefs, lang
                         )
-                    else:
-                        s += f"<p>Source: {custom_source_name}</p>"
-                s += "</aside>"
-            elif (prefs["search_people"] or data["label"] not in PERSON_LABELS) and (
-                intro_cache := self.mediawiki.get_cache(entity)
-            ):
-                s += f'<aside id="{data["id"]}" epub:type="footnote">'
-                s += self.split_p_tags(
-                    intro_cache
-                    if isinstance(intro_cache, str)
-                    else intro_cache["intro"]
-                )
-                s += (
-                    f'<p>Source: <a href="{source_link}{quote(entity)}">'
-                    f"{source_name}</a></p>"
-                )
-                if self.wikidata and (
-                    wikidata_cache := self.wikidata.get_cache(intro_cache["item_id"])
-                ):
-                    add_wikidata_source = False
-                    if inception := wikidata_cache.get("inception"):
-                        s += f"<p>{inception_text(inception)}</p>"
-                        add_wikidata_source = True
-                    if self.wiki_commons and (
-                        filename := wikidata_cache.get("map_filename")
-                    ):
-                        file_path = self.wiki_commons.get_image(filename)
-                        if file_path is not None:
-                            s += (
-                                '<img style="max-width:100%" src="'
-                                f'{image_prefix}{filename}" />'
+                        if custom_source_link:
+                            f.write(
+                                f'<p>Source: <a href="{custom_source_link}'
+                                f'{quote(entity)}">{custom_source_name}</a></p>'
                             )
-                            shutil.copy(file_path, self.image_folder.joinpath(filename))
-                            self.image_filenames.add(filename)
-                            add_wikidata_source = True
-                    if add_wikidata_source:
-                        s += (
-                            '<p>Source: <a href="https://www.wikidata.org/wiki/'
-                            f'{intro_cache["item_id"]}">Wikidata</a></p>'
+                        else:
+                            f.write(f"<p>Source: {custom_source_name}</p>")
+                    f.write("</aside>")
+                elif (
+                    prefs["search_people"] or data["label"] not in PERSON_LABELS
+                ) and (intro_cache := intro_caches.get(entity)):
+                    f.write(f'<aside id="{data["id"]}" epub:type="footnote">')
+                    f.write(
+                        self.split_p_tags(
+                            intro_cache
+                            if isinstance(intro_cache, str)
+                            else intro_cache["intro"]
                         )
-                s += "</aside>"
-            else:
-                s += (
-                    f'<aside id="{data["id"]}" epub:type="footnote"><p>'
-                    f'{escape(data["quote"])}</p></aside>'
-                )
+                    )
+                    f.write(
+                        f'<p>Source: <a href="{source_link}{quote(entity)}">'
+                        f"{source_name}</a></p>"
+                    )
+                    if self.wikidata and (
+                        wikidata_cache := wikidata_caches.get(intro_cache["item_id"])
+                    ):
+                        add_wikidata_source = False
+                        if inception := wikidata_cache.get("inception"):
+                            f.write(f"<p>{inception_text(inception)}</p>")
+                            add_wikidata_source = True
+                        if self.wiki_commons and (
+                            filename := wikidata_cache.get("map_filename")
+                        ):
+                            file_path = self.wiki_commons.get_image(filename)
+                            if file_path is not None:
+                                f.write(
+                                    '<img style="max-width:100%" src="'
+                                    f'{image_prefix}{filename}" />'
+                                )
+                                shutil.copy(
+                                    file_path, self.image_folder.joinpath(filename)
+                                )
+                                self.image_filenames.add(filename)
+                                add_wikidata_source = True
+                        if add_wikidata_source:
+                            f.write(
+                                '<p>Source: <a href="https://www.wikidata.org/wiki/'
+                                f'{intro_cache["item_id"]}">Wikidata</a></p>'
+                            )
+                    f.write("</aside>")
+                else:
+                    f.write(
+                        f'<aside id="{data["id"]}" epub:type="footnote"><p>'
+                        f'{escape(data["quote"])}</p></aside>'
+                    )
 
-        s += "</body></html>"
-        with self.xhtml_folder.joinpath("x_ray.xhtml").open("w", encoding="utf-8") as f:
-            f.write(s)
+            f.write("</body></html>")
 
     def create_word_wise_footnotes(self, lang: str) -> None:
-        s = f"""
+        with self.xhtml_folder.joinpath("word_wise.xhtml").open(
+            "w", encoding="utf-8"
+        ) as f:
+            f.write(
+                f"""
         <html xmlns="http://www.w3.org/1999/xhtml"
         xmlns:epub="http://www.idpf.org/2007/ops"
         lang="{lang}" xml:lang="{lang}">
         <head><title>Word Wise</title><meta charset="utf-8"/></head>
         <body>
         """
-        for lemma, lemma_id in self.lemmas.items():
-            s += self.create_ww_aside_tag(lemma, lemma_id, lang)
-        s += "</body></html>"
-        with self.xhtml_folder.joinpath("word_wise.xhtml").open(
-            "w", encoding="utf-8"
-        ) as f:
-            f.write(s)
+            )
+            for lemma, lemma_id in self.lemmas.items():
+                f.write(self.create_ww_aside_tag(lemma, lemma_id, lang))
+            f.write("</body></html>")
 
     def create_ww_aside_tag(self, lemma: str, lemma_id: int, lemma_lang: str) -> str:
         data = self.get_lemma_gloss(lemma, lemma_lang)
@@ -456,13 +534,13 @@ class EPUB:
                 f'<item href="{xhtml_prefix}x_ray.xhtml" '
                 'id="x_ray.xhtml" media-type="application/xhtml+xml"/>'
             )
-            manifest.append(etree.fromstring(s))
+            manifest.append(etree.fromstring(s, self.xml_parser))
         if self.lemmas:
             s = (
                 f'<item href="{xhtml_prefix}word_wise.xhtml" '
                 'id="word_wise.xhtml" media-type="application/xhtml+xml"/>'
             )
-            manifest.append(etree.fromstring(s))
+            manifest.append(etree.fromstring(s, self.xml_parser))
         for filename in self.image_filenames:
             filename_lower = filename.lower()
             if filename_lower.endswith(".svg"):
@@ -479,21 +557,46 @@ class EPUB:
                 f'<item href="{image_prefix}{filename}" id="{filename}" '
                 f'media-type="image/{media_type}"/>'
             )
-            manifest.append(etree.fromstring(s))
+            manifest.append(etree.fromstring(s, self.xml_parser))
         spine = self.opf_root.find("opf:spine", NAMESPACES)
         if self.entities:
-            spine.append(etree.fromstring('<itemref idref="x_ray.xhtml"/>'))
+            spine.append(
+                etree.fromstring('<itemref idref="x_ray.xhtml"/>', self.xml_parser)
+            )
         if self.lemmas:
-            spine.append(etree.fromstring('<itemref idref="word_wise.xhtml"/>'))
+            spine.append(
+                etree.fromstring('<itemref idref="word_wise.xhtml"/>', self.xml_parser)
+            )
         with self.opf_path.open("w", encoding="utf-8") as f:
             f.write(etree.tostring(self.opf_root, encoding=str))
 
     def zip_extract_folder(self) -> None:
-        shutil.make_archive(str(self.extract_folder), "zip", self.extract_folder)
-        self.extract_folder.with_suffix(".zip").replace(self.book_path)
+        zip_path = self.extract_folder.with_suffix(".zip")
+        with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED) as zf:
+            # mimetype must be the first file and uncompressed
+            mimetype_path = self.extract_folder.joinpath("mimetype")
+            if mimetype_path.exists():
+                zf.write(mimetype_path, "mimetype", zipfile.ZIP_STORED)
+            for path in self.extract_folder.rglob("*"):
+                if not path.is_file() or path == mimetype_path:
+                    continue
+                # images are already compressed
+                if path.suffix.lower() in COMPRESSED_IMAGE_SUFFIXES:
+                    compress_type = zipfile.ZIP_STORED
+                else:
+                    compress_type = zipfile.ZIP_DEFLATED
+                zf.write(path, path.relative_to(self.extract_folder), compress_type)
+        zip_path.replace(self.book_path)
         shutil.rmtree(self.extract_folder)
 
     def get_lemma_gloss(self, lemma: str, lang: str) -> list[tuple[str, str, str, str]]:
+        if (lemma, lang) not in self.lemma_glosses:
+            self.lemma_glosses[(lemma, lang)] = self.query_lemma_gloss(lemma, lang)
+        return self.lemma_glosses[(lemma, lang)]
+
+    def query_lemma_gloss(
+        self, lemma: str, lang: str
+    ) -> list[tuple[str, str, str, str]]:
         select_sql = "SELECT short_def, full_def, example, "
         if self.has_multiple_ipas:
             select_sql += self.prefs[f"{lang}_ipa"]
@@ -556,6 +659,10 @@ class EPUB:
         return []
 
 
+def normalize_entity(entity: str) -> str:
+    return entity.casefold().strip(" .,'’")
+
+
 def spacy_to_wiktionary_pos(pos: str) -> str:
     # spaCy POS: https://universaldependencies.org/u/pos
     # Wiktioanry POS: https://github.com/tatuylonen/wiktextract/blob/master/wiktextract/data/en/pos_subtitles.json
@@ -1,11 +1,12 @@
 #!/usr/bin/env python3
 
 import sqlite3
+import string
 from collections import defaultdict
 from datetime import datetime
 from functools import partial
 from pathlib import Path
-from typing import TypedDict
+from typing import Iterator, TypedDict
 from urllib.parse import unquote
 
 try:
@@ -18,6 +19,10 @@ except ImportError:
 MEDIAWIKI_API_EXLIMIT = 20
 
 GPE_LABELS = frozenset(["GPE", "GPE_LOC", "GPE_ORG", "placeName", "LC"])
+# https://www.sqlite.org/limits.html#max_variable_number
+SQLITE_MAX_VARIABLE_NUMBER = 999
+# SQLite's NOCASE collation only folds ASCII characters
+NOCASE_TABLE = str.maketrans(string.ascii_uppercase, string.ascii_lowercase)
 
 
 class WikipediaCache(TypedDict):
@@ -96,6 +101,25 @@ class Wikipedia:
             return {"intro": desc, "item_id": wikidata_item}
         return None
 
+    def get_caches(self, titles: list[str]) -> dict[str, WikipediaCache]:
+        caches: dict[str, WikipediaCache] = {}
+        for chunk in sql_chunks(titles):
+            chunk_titles = group_nocase_titles(chunk)
+            for title, desc, wikidata_item in self.db_conn.execute(
+                f"""
+                SELECT title, description, wikidata_item
+                FROM titles JOIN descriptions ON titles.desc_id = descriptions.id
+                WHERE title IN ({",".join("?" * len(chunk))})
+                """,
+                chunk,
+            ):
+                for requested_title in chunk_titles[title.translate(NOCASE_TABLE)]:
+                    caches[requested_title] = {
+                        "intro": desc,
+                        "item_id": wikidata_item,
+                    }
+        return caches
+
     def add_title(self, title: str, desc_id: int | None) -> None:
         self.db_conn.execute(
             "INSERT OR IGNORE INTO titles VALUES(?, ?)", (title, desc_id)
@@ -298,6 +322,22 @@ class Fandom:
             return desc
         return None
 
+    def get_caches(self, titles: list[str]) -> dict[str, str]:
+        caches: dict[str, str] = {}
+        for chunk in sql_chunks(titles):
+            chunk_titles = group_nocase_titles(chunk)
+            for title, desc in self.db_conn.execute(
+                f"""
+                SELECT title, description FROM titles JOIN descriptions
+                ON titles.desc_id = descriptions.id
+                WHERE title IN ({",".join("?" * len(chunk))})
+                """,
+                chunk,
+            ):
+                for requested_title in chunk_titles[title.translate(NOCASE_TABLE)]:
+                    caches[requested_title] = desc
+        return caches
+
     def add_title(self, title: str, desc_id: int | None) -> None:
         self.db_conn.execute(
             "INSERT OR IGNORE INTO titles VALUES(?, ?)", (title, desc_id)
@@ -446,6 +486,19 @@ class Wikidata:
             return {"map_filename": map_filename, "inception": inception}
         return None
 
+    def get_caches(self, items: list[str]) -> dict[str, WikidataCache]:
+        caches: dict[str, WikidataCache] = {}
+        for chunk in sql_chunks(items):
+            for item, map_filename, inception in self.db_conn.execute(
+                f"""
+                SELECT item, map_filename, inception FROM wikidata
+                WHERE item IN ({",".join("?" * len(chunk))})
+                """,
+                chunk,
+            ):
+                caches[item] = {"map_filename": map_filename, "inception": inception}
+        return caches
+
     def query(self, items: list[str]) -> None:
         items_str = " ".join(map(lambda x: f"wd:{x}", items))
         query = f"""
@@ -482,6 +535,21 @@ class Wikidata:
                 self.add_cache(item_id, None, None)
 
 
+def sql_chunks(values: list[str]) -> Iterator[list[str]]:
+    for index in range(0, len(values), SQLITE_MAX_VARIABLE_NUMBER):
+        yield values[index : index + SQLITE_MAX_VARIABLE_NUMBER]
+
+
+def group_nocase_titles(titles: list[str]) -> defaultdict[str, list[str]]:
+    """
+    Group titles that are equal using SQLite's NOCASE collation.
+    """
+    groups: defaultdict[str, list[str]] = defaultdict(list)
+    for title in titles:
+        groups[title.translate(NOCASE_TABLE)].append(title)
+    return groups
+
+
 def inception_text(inception_str: str) -> str:
     # don't need to remove the last "Z" in Python 3.11
     inception_str = inception_str.removesuffix("Z")
@@ -8,7 +8,6 @@ from dataclasses import asdict, dataclass
 from html import escape, unescape
 from itertools import chain
 from pathlib import Path
-from sqlite3 import Connection
 from typing import Any, Iterator
 
 try:
@@ -19,7 +18,7 @@ try:
         create_x_ray_db,
         get_ll_path,
         get_x_ray_path,
-        insert_lemma,
+        insert_lemmas,
         save_db,
     )
     from .deps import download_word_wise_file, install_deps, which_python
@@ -53,7 +52,7 @@ except ImportError:
         create_x_ray_db,
         get_ll_path,
         get_x_ray_path,
-        insert_lemma,
+        insert_lemmas,
         save_db,
     )
     from dump_lemmas import save_spacy_docs, spacy_doc_path
@@ -75,6 +74,12 @@ except ImportError:
     from x_ray_share import NER_LABELS, CustomX, get_custom_x_path, load_custom_x_desc
 
 
+MOBI_BODY_RE = re.compile(rb"<body.{3,}?</body>", re.DOTALL)
+MOBI_TEXT_RE = re.compile(rb">([^<]{2,})<")
+# byte order mark and word joiner
+SPACE_CHARS_TABLE = str.maketrans("\ufeff\u2060", "  ")
+
+
 @dataclass
 class ParseJobData:
     book_id: int = 0
@@ -202,7 +207,7 @@ def do_job(
 
         run_subprocess(args, input_str)
     else:
-        create_files(data, prefs, notifications)
+        create_files(data, prefs, notifications, in_calibre_process=True)
 
     return data
 
@@ -219,7 +224,9 @@ def calculate_final_start(data: ParseJobData) -> int:
             return 0
 
 
-def create_files(data: ParseJobData, prefs: Prefs, notif: Any) -> None:
+def create_files(
+    data: ParseJobData, prefs: Prefs, notif: Any, in_calibre_process: bool = False
+) -> None:
     """
     This function runs in system Python subprocess for official(frozen) calibre build.
     """
@@ -229,6 +236,13 @@ def create_files(data: ParseJobData, prefs: Prefs, notif: Any) -> None:
     nlp = load_spacy(
         data.spacy_model, data.book_path if data.create_x else None, prefs["use_pos"]
     )
+    # GPU(transformer model) can't be shared by multiple processes
+    # and spaCy can't start processes from calibre GUI's job thread
+    n_process = (
+        1
+        if data.spacy_model.endswith("_trf") or in_calibre_process
+        else prefs["spacy_processes"]
+    )
     lemmas_conn = None
     if data.create_ww:
         lemmas_db_path = (
@@ -275,7 +289,7 @@ def create_files(data: ParseJobData, prefs: Prefs, notif: Any) -> None:
             epub = EPUB(data.book_path, None, None, None, None)
 
         for doc, (start, escaped_text, xhtml_path) in nlp.pipe(
-            epub.extract_epub(), as_tuples=True
+            epub.extract_epub(), as_tuples=True, n_process=n_process
         ):
             intervals = []
             if data.create_x:
@@ -324,6 +338,7 @@ def create_files(data: ParseJobData, prefs: Prefs, notif: Any) -> None:
             data.acr,
             data.revision,
         )
+        lemmas_data: dict[tuple[str, str | None], tuple[int, int] | None] = {}
 
     if data.create_x:
         x_ray_conn, x_ray_path = create_x_ray_db(
@@ -335,7 +350,7 @@ def create_files(data: ParseJobData, prefs: Prefs, notif: Any) -> None:
         )
         x_ray = X_Ray(x_ray_conn, mediawiki, wikidata, custom_x_ray)
 
-    for doc, context in nlp.pipe(parse_book(data), as_tuples=True):
+    for doc, context in nlp.pipe(parse_book(data), as_tuples=True, n_process=n_process):
         if data.kfx_json is not None:
             start = context
             escaped_text = None
@@ -363,6 +378,7 @@ def create_files(data: ParseJobData, prefs: Prefs, notif: Any) -> None:
                 ll_conn,
                 data.book_lang,
                 prefs,
+                lemmas_data,
             )
         if notif:
             notif.put((start / final_start, "Creating files"))
@@ -385,14 +401,18 @@ def parse_book(data: ParseJobData) -> Iterator[tuple[str, tuple[int, str] | int]
     if data.kfx_json is not None:
         for entry in filter(lambda x: x["type"] == 1, data.kfx_json):
             # Remove byte order mark and word joiner
-            yield re.sub(r"\ufeff|\u2060", " ", entry["content"]), entry["position"]
+            yield entry["content"].translate(SPACE_CHARS_TABLE), entry["position"]
     elif data.mobi_html is not None:
+        # decode text from the HTML buffer without copying it to bytes first
+        mobi_html_view = memoryview(data.mobi_html)
         # match text inside HTML tags
-        for match_body in re.finditer(b"<body.{3,}?</body>", data.mobi_html, re.DOTALL):
-            for m in re.finditer(b">[^<]{2,}<", match_body.group(0)):
-                text = m.group(0)[1:-1].decode(data.mobi_codec)
-                text = re.sub(r"\ufeff|\u2060", " ", text)
-                yield unescape(text), (match_body.start() + m.start() + 1, text)
+        for match_body in MOBI_BODY_RE.finditer(data.mobi_html):
+            for m in MOBI_TEXT_RE.finditer(
+                data.mobi_html, match_body.start(), match_body.end()
+            ):
+                text = str(mobi_html_view[m.start(1) : m.end(1)], data.mobi_codec)
+                text = text.translate(SPACE_CHARS_TABLE)
+                yield unescape(text), (m.start(1), text)
 
 
 def index_in_escaped_text(
@@ -409,6 +429,27 @@ def index_in_escaped_text(
         return None
 
 
+class EncodedOffset:
+    """
+    Convert string index to byte offset of the encoded string, only encode the
+    text between the last index and the new index when indexes are ascending.
+    """
+
+    def __init__(self, text: str, codec: str) -> None:
+        self.text = text
+        self.codec = codec
+        self.index = 0
+        self.offset = 0
+
+    def get(self, index: int) -> int:
+        if index < self.index:
+            self.index = 0
+            self.offset = 0
+        self.offset += len(self.text[self.index : index].encode(self.codec))
+        self.index = index
+        return self.offset
+
+
 def match_lemmas(doc, lemma_matcher, phrase_matcher):
     from spacy.util import filter_spans
 
@@ -430,28 +471,36 @@ def kindle_find_lemma(
     ll_conn,
     lemma_lang,
     prefs,
+    lemmas_data,
 ):
     lemma_starts: set[int] = set()
+    glosses: list[tuple[int, int | None, int, int]] = []
+    escaped_offset = EncodedOffset(escaped_text, mobi_codec) if mobi_codec else None
     for span in match_lemmas(doc, lemma_matcher, phrase_matcher):
-        data = get_kindle_lemma_data(
-            span.lemma_ if prefs["use_pos"] and hasattr(span, "lemma_") else span.text,
-            span.doc[span.start].pos_ if prefs["use_pos"] else None,
-            lemmas_conn,
-            lemma_lang,
-            prefs,
+        lemma = (
+            span.lemma_ if prefs["use_pos"] and hasattr(span, "lemma_") else span.text
         )
+        pos = span.doc[span.start].pos_ if prefs["use_pos"] else None
+        # query each word once per book
+        if (lemma, pos) not in lemmas_data:
+            lemmas_data[(lemma, pos)] = get_kindle_lemma_data(
+                lemma, pos, lemmas_conn, lemma_lang, prefs
+            )
+        data = lemmas_data[(lemma, pos)]
         if data is not None:
             kindle_add_lemma(
                 span.start_char,
                 span.end_char,
                 start,
                 doc.text,
-                ll_conn,
+                glosses,
                 mobi_codec,
                 escaped_text,
+                escaped_offset,
                 lemma_starts,
                 data,
             )
+    insert_lemmas(ll_conn, glosses)
 
 
 def epub_find_lemma(
@@ -591,20 +640,21 @@ def kindle_add_lemma(
     token_end: int,
     text_start: int,
     text: str,
-    ll_conn: Connection,
+    glosses: list[tuple[int, int | None, int, int]],
     mobi_codec: str,
     escaped_text: str,
+    escaped_offset: EncodedOffset | None,
     starts: set[int],
     data: tuple[int, int],
 ):
     end = None
     lemma = text[token_start:token_end]
-    if mobi_codec:
+    if escaped_offset is not None:
         result = index_in_escaped_text(lemma, escaped_text, token_start)
         if result is None:
             return
         lemma_start, lemma_end = result
-        index = text_start + len(escaped_text[:lemma_start].encode(mobi_codec))
+        index = text_start + escaped_offset.get(lemma_start)
     else:
         index = text_start + token_start
 
@@ -618,7 +668,7 @@ def kindle_add_lemma(
             end = index + len(escaped_text[lemma_start:lemma_end].encode(mobi_codec))
         else:
             end = index + len(lemma)
-    insert_lemma(ll_conn, (index, end) + data)
+    glosses.append((index, end) + data)
 
 
 def epub_add_lemma(
@@ -667,33 +717,51 @@ DIRECTIONS = frozenset(
 )
 
 
-def process_entity(text: str, lang: str, len_limit: int) -> str | None:
-    if re.search(r"https?:|www\.", text, re.IGNORECASE):
+URL_RE = re.compile(r"https?:|www\.", re.IGNORECASE)
+LEADING_NON_WORD_RE = re.compile(r"^\W+")
+TRAILING_NON_WORD_RE = re.compile(r"\W+$")
+NON_WORD_OR_DIGIT_RE = re.compile(r"[\W\d]+")
+# chapter title(chapter 1) and page number reference(pp. 1-10)
+EN_CHAPTER_PAGE_RE = re.compile(r"c?hapter|p{1,2}[\W\d]{2,}", re.IGNORECASE)
+EN_SUFFIX_RE = re.compile(r"\W+[sd]$|\s+of$")
+EN_ARTICLE_RE = re.compile(r"^(?:the|an?)\s", re.IGNORECASE)
+# https://en.wikipedia.org/wiki/Spanish_determiners#Articles
+ES_ARTICLE_RE = re.compile(r"^(?:el|los?|las?|un|unos?|unas?)\s", re.IGNORECASE)
+PUNCTUATION_RE = re.compile(r"[^\w\s]")
+
+
+def remove_prefix(pattern: re.Pattern[str], text: str, offset: int) -> tuple[str, int]:
+    if m := pattern.match(text):
+        return text[m.end() :], offset + m.end()
+    return text, offset
+
+
+def process_entity(text: str, lang: str, len_limit: int) -> tuple[str, int] | None:
+    """
+    Return cleaned entity text and its start index in the original text.
+    """
+    if URL_RE.search(text):
         return None
-    text = re.sub(r"^\W+", "", text)
-    text = re.sub(r"\W+$", "", text)
+    text, offset = remove_prefix(LEADING_NON_WORD_RE, text, 0)
+    text = TRAILING_NON_WORD_RE.sub("", text)
 
     if lang == "en":
-        # ignore chapter title(chapter 1) and page number reference(pp. 1-10)
-        if re.match(r"c?hapter|p{1,2}[\W\d]{2,}", text, re.IGNORECASE):
+        if EN_CHAPTER_PAGE_RE.match(text):
             return None
-        text = re.sub(r"\W+[sd]$|\s+of$", "", text)
-        text = re.sub(r"^(?:the|an?)\s", "", text, flags=re.IGNORECASE)
-        text = re.sub(r"^\W+", "", text)
+        text = EN_SUFFIX_RE.sub("", text)
+        text, offset = remove_prefix(EN_ARTICLE_RE, text, offset)
+        text, offset = remove_prefix(LEADING_NON_WORD_RE, text, offset)
         if text.lower() in DIRECTIONS:
             return None
     elif lang == "es":
-        # https://en.wikipedia.org/wiki/Spanish_determiners#Articles
-        text = re.sub(
-            r"^(?:el|los?|las?|un|unos?|unas?)\s", "", text, flags=re.IGNORECASE
-        )
-        text = re.sub(r"^\W+", "", text)
+        text, offset = remove_prefix(ES_ARTICLE_RE, text, offset)
+        text, offset = remove_prefix(LEADING_NON_WORD_RE, text, offset)
     # TODO https://en.wikipedia.org/wiki/Article_(grammar)#Tables
 
-    if len(text) < len_limit or re.fullmatch(r"[\W\d]+", text):
+    if len(text) < len_limit or NON_WORD_OR_DIGIT_RE.fullmatch(text):
         return None
 
-    return text
+    return text, offset
 
 
 def find_named_entity(
@@ -709,13 +777,16 @@ def find_named_entity(
     len_limit = 2 if lang in CJK_LANGS else 3
     starts = set()
     intervals = []
+    escaped_offset = EncodedOffset(escaped_text, mobi_codec) if mobi_codec else None
     for ent in filter(lambda x: x.label_ in NER_LABELS, doc.ents):
-        text = (
-            ent.ent_id_  # customized X-Ray
-            if ent.ent_id_
-            else process_entity(ent.text, lang, len_limit)
-        )
-        if text is None or (ent.ent_id_ and custom_x_ray.get(ent.ent_id_)[2]):
+        if ent.ent_id_:  # customized X-Ray
+            if custom_x_ray.get(ent.ent_id_)[2]:
+                continue
+            text = ent.ent_id_
+            text_offset = 0
+        elif processed := process_entity(ent.text, lang, len_limit):
+            text, text_offset = processed
+        else:
             continue
 
         ent_text = ent.text if ent.ent_id_ else text
@@ -727,7 +798,7 @@ def find_named_entity(
             if start_char is None:
                 continue
         elif not ent.ent_id_:
-            start_char = ent.start_char + ent.text.index(ent_text)
+            start_char = ent.start_char + text_offset
             end_char = start_char + len(ent_text)
         else:
             start_char = ent.start_char
@@ -753,10 +824,10 @@ def find_named_entity(
             continue
 
         # Include the next punctuation so the word can be selected on Kindle
-        if re.match(r"[^\w\s]", book_text[end_char : end_char + 1]):
+        if PUNCTUATION_RE.match(book_text, end_char, end_char + 1):
             selectable_text = book_text[start_char : end_char + 1]
-        if mobi_codec:
-            ent_start = start + len(escaped_text[:start_char].encode(mobi_codec))
+        if escaped_offset is not None:
+            ent_start = start + escaped_offset.get(start_char)
             ent_len = len(selectable_text.encode(mobi_codec))
         else:
             ent_start = start + start_char
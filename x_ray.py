@@ -2,16 +2,16 @@
 
 import re
 from collections import Counter, defaultdict
-from functools import partial
 from pathlib import Path
 from sqlite3 import Connection
+from typing import Iterator
 
 try:
     from .database import (
         create_x_indices,
         insert_x_book_metadata,
         insert_x_entities,
-        insert_x_entity_description,
+        insert_x_entity_descriptions,
         insert_x_excerpt_image,
         insert_x_occurrences,
         insert_x_type,
@@ -33,7 +33,7 @@ except ImportError:
         create_x_indices,
         insert_x_book_metadata,
         insert_x_entities,
-        insert_x_entity_description,
+        insert_x_entity_descriptions,
         insert_x_excerpt_image,
         insert_x_occurrences,
         insert_x_type,
@@ -65,6 +65,8 @@ class X_Ray:
         self.num_people = 0
         self.num_terms = 0
         self.entities: dict[str, XRayEntity] = {}
+        # entity name -> `default_process` result, in the order of `entities`
+        self.processed_entities: dict[str, str] = {}
         self.people_counter: Counter[str] = Counter()
         self.terms_counter: Counter[str] = Counter()
         self.num_images = 0
@@ -73,14 +75,14 @@ class X_Ray:
         self.entity_occurrences: dict[int, list[tuple[int, int]]] = defaultdict(list)
         self.custom_x_ray = custom_x_ray
 
-    def insert_descriptions(self, search_people: bool) -> None:
+    def entity_descriptions(
+        self, search_people: bool
+    ) -> Iterator[tuple[str, str, int | None, int]]:
         for entity, data in self.entities.items():
             if custom_data := self.custom_x_ray.get(entity):
                 custom_desc, custom_source, _ = custom_data
                 if custom_desc:
-                    insert_x_entity_description(
-                        self.conn, (custom_desc, entity, custom_source, data["id"])
-                    )
+                    yield custom_desc, entity, custom_source, data["id"]
                     continue
 
             if (search_people or data["label"] not in PERSON_LABELS) and (
@@ -96,13 +98,9 @@ class X_Ray:
                 ):
                     if inception := wikidata_cache.get("inception"):
                         summary += "\n" + inception_text(inception)
-                insert_x_entity_description(
-                    self.conn, (summary, entity, self.mediawiki.source_id, data["id"])
-                )
+                yield summary, entity, self.mediawiki.source_id, data["id"]
             else:
-                insert_x_entity_description(
-                    self.conn, (data["quote"], entity, None, data["id"])
-                )
+                yield data["quote"], entity, None, data["id"]
 
     def add_entity(
         self, entity: str, ner_label: str, start: int, quote: str, entity_len: int
@@ -115,14 +113,15 @@ class X_Ray:
             entity_id = entity_data["id"]
             ner_label = entity_data["label"]
         elif entity not in self.custom_x_ray and (
+            # choices are already processed, only process the query once
             r := extractOne(
-                entity,
-                self.entities.keys(),
+                default_process(entity),
+                self.processed_entities,
                 score_cutoff=FUZZ_THRESHOLD,
-                scorer=partial(token_set_ratio, processor=default_process),
+                scorer=token_set_ratio,
             )
         ):
-            matched_name = r[0]
+            matched_name = r[2]
             matched_entity = self.entities[matched_name]
             matched_label = matched_entity["label"]
             entity_id = matched_entity["id"]
@@ -130,6 +129,8 @@ class X_Ray:
                 # replace partial name with full name
                 self.entities[entity] = self.entities[matched_name]
                 del self.entities[matched_name]
+                self.processed_entities[entity] = default_process(entity)
+                del self.processed_entities[matched_name]
             ner_label = matched_label
         else:
             entity_id = self.entity_id
@@ -138,6 +139,7 @@ class X_Ray:
                 "label": ner_label,
                 "quote": quote,
             }
+            self.processed_entities[entity] = default_process(entity)
             self.entity_id += 1
 
         if ner_label in PERSON_LABELS:
@@ -223,7 +225,9 @@ class X_Ray:
                 for start, entity_length in occurrence_list
             ),
         )
-        self.insert_descriptions(prefs["search_people"])
+        insert_x_entity_descriptions(
+            self.conn, self.entity_descriptions(prefs["search_people"])
+        )
 
         if kfx_json:
             self.find_kfx_images(kfx_json)